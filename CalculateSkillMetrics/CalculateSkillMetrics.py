@@ -1,19 +1,132 @@
 import logging
 import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from math import sqrt
+from math import hypot, sqrt
 
+import numpy as np
 import vtk
 import qt
 
 import slicer
 from slicer.i18n import tr as _
 from slicer.ScriptedLoadableModule import *
-from slicer.util import VTKObservationMixin
+from slicer.util import VTKObservationMixin, arrayFromMarkupsControlPoints
 from slicer.parameterNodeWrapper import (
     parameterNodeWrapper,
 )
 
+# numba is not bundled with Slicer, path lengths fall back to numpy if it is not installed
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+# Camera intrinsics used to convert bounding box pixel coordinates to mm
+_PRINCIPAL_POINT = np.array([314.273, 251.183])
+_FOCAL_LENGTH = 592.667
+_INV_FOCAL_LENGTH = 1.0 / _FOCAL_LENGTH
+
+# Control points of a bounding box markup: top left, top right, bottom left, bottom right
+_NUMBER_OF_CORNERS = 4
+
+# Metrics of a single class, one column of the results table (fields after className are the rows)
+SkillMetrics = namedtuple("SkillMetrics", [
+    "className",
+    "centerPathLength",
+    "totalCornerPathLength",
+    "corner1PathLength",
+    "corner2PathLength",
+    "corner3PathLength",
+    "corner4PathLength",
+    "usageTime",
+])
+
+
+#
+# Path length kernels
+#
+
+
+def _convertPixelsToMM(points):
+    """
+    Converts the x and y coords of an array of points of shape (..., 3) from pixels to mm, in place.
+    Works on a single frame (corners, 3) as well as on a whole sequence (frames, corners, 3).
+    """
+    xy = points[..., :2]
+    xy -= _PRINCIPAL_POINT
+    xy *= points[..., 2:3] * _INV_FOCAL_LENGTH
+    return points
+
+
+def _validFramesMask(frames):
+    """
+    Frame is invalid if all markup points are at (0,0,0), which occurs when the tool is out of frame,
+    or if any coordinate is NaN or infinite. frames has shape (..., corners, 3), the mask has shape (...).
+    """
+    return frames.any(axis=(-2, -1)) & np.isfinite(frames).all(axis=(-2, -1))
+
+
+def _scanPathLengths(frames, timestamps, validFrames):
+    """
+    Accumulates the center path length, per corner path lengths and usage time
+    over consecutive valid frames. frames holds corner positions in mm, shape (frames, corners, 3).
+    Written as a plain loop so that it can be JIT-compiled with numba.
+    """
+    numberOfFrames, numberOfCorners = frames.shape[0], frames.shape[1]
+    centerPathLength = 0.0
+    cornerPathLengths = np.zeros(numberOfCorners)
+    usageTime = 0.0
+    for i in range(1, numberOfFrames):
+        if not (validFrames[i] and validFrames[i - 1]):
+            continue
+        centerDx = centerDy = centerDz = 0.0
+        for j in range(numberOfCorners):
+            dx = frames[i, j, 0] - frames[i - 1, j, 0]
+            dy = frames[i, j, 1] - frames[i - 1, j, 1]
+            dz = frames[i, j, 2] - frames[i - 1, j, 2]
+            cornerPathLengths[j] += sqrt(dx * dx + dy * dy + dz * dz)
+            centerDx += dx
+            centerDy += dy
+            centerDz += dz
+        centerDx /= numberOfCorners
+        centerDy /= numberOfCorners
+        centerDz /= numberOfCorners
+        centerPathLength += sqrt(centerDx * centerDx + centerDy * centerDy + centerDz * centerDz)
+        usageTime += timestamps[i] - timestamps[i - 1]
+    return centerPathLength, cornerPathLengths, usageTime
+
+
+def _vectorizedPathLengths(frames, timestamps, validFrames):
+    """
+    Same as _scanPathLengths, using vectorized numpy operations.
+    """
+    # Only compute metrics between consecutive valid frames
+    validSteps = validFrames[1:] & validFrames[:-1]
+    cornerSteps = np.diff(frames, axis=0)[validSteps]
+    # The center is the mean of the corners, so its step is the mean of the corner steps
+    centerSteps = cornerSteps.mean(axis=1)
+
+    centerPathLength = float(np.sqrt(np.einsum("fi,fi->f", centerSteps, centerSteps)).sum())
+    cornerPathLengths = np.sqrt(np.einsum("fci,fci->fc", cornerSteps, cornerSteps)).sum(axis=0)
+    usageTime = float(np.diff(timestamps)[validSteps].sum())
+    return centerPathLength, cornerPathLengths, usageTime
+
+
+_pathLengths = _vectorizedPathLengths
+if HAS_NUMBA:
+    # Compile (or load from cache) at import, so the first calculation does not pay the JIT cost.
+    # A numba failure (e.g. no writable cache location) must not prevent the module from loading.
+    try:
+        _compiledPathLengths = njit(cache=True, fastmath=True, nogil=True)(_scanPathLengths)
+        _compiledPathLengths(np.zeros((2, _NUMBER_OF_CORNERS, 3)), np.zeros(2), np.ones(2, dtype=np.bool_))
+        _pathLengths = _compiledPathLengths
+    except Exception as e:
+        logging.warning(f"Failed to compile path length kernel with numba, using numpy instead: {e}")
+
 
 #
 # CalculateSkillMetrics
@@ -161,11 +274,16 @@ class CalculateSkillMetricsWidget(ScriptedLoadableModuleWidget, VTKObservationMi
 
     def onCalculateButton(self) -> None:
         """Run processing when user clicks "Apply" button."""
-        with slicer.util.tryWithErrorDisplay(_("Failed to compute results."), waitCursor=True):
-            self.logic.calculate(
-                self.ui.sequenceBrowserNode.currentNode(),
-                self.ui.table
-            )
+        # Prevent starting another calculation while events are processed during this one
+        self.ui.calculateButton.enabled = False
+        try:
+            with slicer.util.tryWithErrorDisplay(_("Failed to compute results."), waitCursor=True):
+                self.logic.calculate(
+                    self.ui.sequenceBrowserNode.currentNode(),
+                    self.ui.table
+                )
+        finally:
+            self._checkCanApply()
 
 
 #
@@ -187,140 +305,130 @@ class CalculateSkillMetricsLogic(ScriptedLoadableModuleLogic):
         """Called when the logic class is instantiated. Can be used for initializing member variables."""
         ScriptedLoadableModuleLogic.__init__(self)
         self.sequenceBrowser = None
-        self.boundingBoxSequences = []  # format: [[classname, sequenceNode]]
-        self.roiSequences = []          # format: [[classname, sequenceNode]]
+        self.boundingBoxClassNames = []     # parallel to boundingBoxSequenceNodes
+        self.boundingBoxSequenceNodes = []
+        self.roiClassNames = []             # parallel to roiSequenceNodes
+        self.roiSequenceNodes = []
+        self._lastTableSchema = None        # format: (rowLabels, columnLabels)
 
     def getParameterNode(self):
         return CalculateSkillMetricsParameterNode(super().getParameterNode())
 
     def computeCenterOfBoundingBox(self, markupsNode):
         """
-        Computes the center of the bounding box from the four corners
+        Computes the center of the bounding box from the four corners, adjusting for mm.
+        Returns a numpy array [x, y, z].
         """
-        corners = self.getCornerPositionsOfBoundingBox(markupsNode)
-        x, y, z = zip(*corners)
-        return [sum(x) / len(x), sum(y) / len(y), sum(z) / len(z)]
+        return self.getCornerPositionsOfBoundingBox(markupsNode).mean(axis=0)
 
     def getCornerPositionsOfBoundingBox(self, markupsNode):
         """
-        Returns a list of the bounding box corner positions, adjusting for mm.
+        Returns a numpy array of the bounding box corner positions, adjusting for mm.
         corners = [[top left], [top right], [bottom left], [bottom right]]
         """
-        corners = []
-        for i in range(markupsNode.GetNumberOfControlPoints()):
-            pos = [0, 0 ,0]
-            markupsNode.GetNthControlPointPosition(i, pos)
-
-            # Convert x and y coords to mm
-            xMM, yMM = self.convertPixelsToMM(pos[0], pos[1], pos[2])
+        corners = arrayFromMarkupsControlPoints(markupsNode)
 
-            corners.append([xMM, yMM, pos[2]])
-
-        return corners
-
-
-    def convertPixelsToMM(self, xPixels, yPixels, zMM, principlePoint = [314.273, 251.183], focalLength = 592.667):
-        xMM = (xPixels - principlePoint[0]) * zMM / focalLength
-        yMM = (yPixels - principlePoint[1]) * zMM / focalLength
-        return xMM, yMM
+        # Convert x and y coords to mm
+        return _convertPixelsToMM(corners)
 
     def isMarkupsFrameValid(self, markupsNode):
         """
-        Frame is invalid if the markup points are at (0,0,0).
-        This occurs when the tool is out of frame.
+        Frame is invalid if it does not have one point per corner, if the markup points are at (0,0,0)
+        (this occurs when the tool is out of frame), or if any coordinate is NaN or infinite.
         """
-        for i in range(markupsNode.GetNumberOfControlPoints()):
-            pos = [0, 0 ,0]
-            markupsNode.GetNthControlPointPosition(i, pos)
-            if pos != [0, 0, 0]:
-                return True
-        return False
+        points = arrayFromMarkupsControlPoints(markupsNode)
+        return points.shape[0] == _NUMBER_OF_CORNERS and bool(_validFramesMask(points))
 
     def isROIFrameValid(self, roiNode):
         # TODO: get some check that checks if the ROI frame is valid
         return True
 
     def euclideanDistance(self, point1, point2):
-        return sqrt(sum((point2[j] - point1[j]) ** 2 for j in range(3)))
+        return hypot(point2[0] - point1[0], point2[1] - point1[1], point2[2] - point1[2])
 
-    def calculateMetricsFromSequence(self, boundingBoxSequence):
+    def readFramesFromSequence(self, boundingBoxSequence):
+        """
+        Reads the bounding box corners of every frame of a sequence, adjusting for mm.
+        Returns (frames, timestamps, validFrames), or None if fewer than two frames are valid.
+        Accesses MRML nodes, so it must be called from the main thread.
+        """
         numberOfFrames = boundingBoxSequence.GetNumberOfDataNodes()
-        centerPathLength = corner1PathLength = corner2PathLength = corner3PathLength = corner4PathLength = 0.0
-        usageTime = 0.0
+        if numberOfFrames == 0:
+            return None
 
-        lastCenter = None
-        lastCorner1 = None
-        lastCorner2 = None
-        lastCorner3 = None
-        lastCorner4 = None
-        lastTimestamp = None
+        getNthDataNode = boundingBoxSequence.GetNthDataNode
+        getNthIndexValue = boundingBoxSequence.GetNthIndexValue
 
+        # Read markup points of every frame into a single preallocated (frames, corners, 3) array.
+        # Data nodes are read straight from the sequence: GetNthDataNode returns the stored node
+        # without copying it, while stepping the browser would update every synchronized proxy node.
+        frames = np.zeros((numberOfFrames, _NUMBER_OF_CORNERS, 3))
+        completeFrames = np.zeros(numberOfFrames, dtype=bool)
         for i in range(numberOfFrames):
-            indexValue = boundingBoxSequence.GetNthIndexValue(i)  # timestamp
-            markupsNode = boundingBoxSequence.GetNthDataNode(i)  # markupsNode at timestamp
+            # Keep the GUI responsive while reading long sequences
+            if i & 0x3FF == 0:
+                slicer.app.processEvents()
 
-            # Skip frame if invalid
-            if not self.isMarkupsFrameValid(markupsNode):
-                lastCenter = None
-                lastCorner1 = None
-                lastCorner2 = None
-                lastCorner3 = None
-                lastCorner4 = None
-                lastTimestamp = None
+            # Frame is invalid (and left at zero) if it does not have exactly one point per corner
+            markupsNode = getNthDataNode(i)
+            if markupsNode.GetNumberOfControlPoints() != _NUMBER_OF_CORNERS:
                 continue
+            completeFrames[i] = True
+            for j in range(_NUMBER_OF_CORNERS):
+                markupsNode.GetNthControlPointPosition(j, frames[i, j])
 
-            # Convert index value to float timestamp
-            timestamp = float(indexValue)
+        validFrames = completeFrames & _validFramesMask(frames)
 
-            # Compute center of bounding box
-            center = self.computeCenterOfBoundingBox(markupsNode)
+        # Nothing to accumulate if the tool is visible in fewer than two frames
+        if np.count_nonzero(validFrames) < 2:
+            return None
 
-            # Get 4 corners of bounding box
-            corners = self.getCornerPositionsOfBoundingBox(markupsNode)
-            corner1, corner2, corner3, corner4 = corners
+        timestamps = np.asarray([getNthIndexValue(i) for i in range(numberOfFrames)], dtype=np.float64)
 
-            # Compute metrics if previous frame was valid
-            if lastCenter is not None and lastTimestamp is not None:
-                timeDiff = timestamp - lastTimestamp
+        # Convert x and y coords of every corner to mm
+        _convertPixelsToMM(frames)
 
-                centerDistance = self.euclideanDistance(lastCenter, center)
-                corner1Distance = self.euclideanDistance(lastCorner1, corner1)
-                corner2Distance = self.euclideanDistance(lastCorner2, corner2)
-                corner3Distance = self.euclideanDistance(lastCorner3, corner3)
-                corner4Distance = self.euclideanDistance(lastCorner4, corner4)
+        return frames, timestamps, validFrames
 
-                centerPathLength += centerDistance
-                corner1PathLength += corner1Distance
-                corner2PathLength += corner2Distance
-                corner3PathLength += corner3Distance
-                corner4PathLength += corner4Distance
-                usageTime += timeDiff
+    def calculateMetricsFromFrames(self, sequenceFrames):
+        """
+        Computes the metrics of a bounding box sequence from the output of readFramesFromSequence.
+        Does not access MRML nodes, so it can run on a worker thread.
+        """
+        if sequenceFrames is None:
+            return 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
+        frames, timestamps, validFrames = sequenceFrames
 
-            lastCenter = center
-            lastCorner1 = corner1
-            lastCorner2 = corner2
-            lastCorner3 = corner3
-            lastCorner4 = corner4
-            lastTimestamp = timestamp
+        centerPathLength, cornerPathLengths, usageTime = _pathLengths(frames, timestamps, validFrames)
+        centerPathLength = float(centerPathLength)
+        usageTime = float(usageTime)
+        corner1PathLength, corner2PathLength, corner3PathLength, corner4PathLength = cornerPathLengths.tolist()
 
         totalCornerPathLength = corner1PathLength + corner2PathLength + corner3PathLength + corner4PathLength
         return centerPathLength, totalCornerPathLength, corner1PathLength, corner2PathLength, corner3PathLength, corner4PathLength, usageTime
 
+    def calculateMetricsFromSequence(self, boundingBoxSequence):
+        return self.calculateMetricsFromFrames(self.readFramesFromSequence(boundingBoxSequence))
+
     def calculateMetricsFromROISequence(self, roiSequence):
         numberOfFrames = roiSequence.GetNumberOfDataNodes()
         centerPathLength = 0.0
         usageTime = 0.0
 
-        lastCenter = None
+        # Center buffers are swapped every frame instead of allocating a new list
+        center = [0.0, 0.0, 0.0]
+        lastCenter = [0.0, 0.0, 0.0]
         lastTimestamp = None
 
+        getNthDataNode = roiSequence.GetNthDataNode
+        getNthIndexValue = roiSequence.GetNthIndexValue
+
         for i in range(numberOfFrames):
-            indexValue = roiSequence.GetNthIndexValue(i)  # timestamp
-            roiNode = roiSequence.GetNthDataNode(i)       # roiNode at timestamp
+            indexValue = getNthIndexValue(i)  # timestamp
+            roiNode = getNthDataNode(i)       # roiNode at timestamp
 
             # Skip frame if invalid
             if not self.isROIFrameValid(roiNode):
-                lastCenter = None
                 lastTimestamp = None
                 continue
 
@@ -328,11 +436,10 @@ class CalculateSkillMetricsLogic(ScriptedLoadableModuleLogic):
             timestamp = float(indexValue)
 
             # Compute center of ROI node
-            center = [0.0, 0.0, 0.0]
             roiNode.GetCenter(center)
 
             # Compute metrics if previous frame was valid
-            if lastCenter and lastTimestamp:
+            if lastTimestamp is not None:
                 timeDiff = timestamp - lastTimestamp
 
                 centerDistance = self.euclideanDistance(lastCenter, center)
@@ -340,101 +447,125 @@ class CalculateSkillMetricsLogic(ScriptedLoadableModuleLogic):
                 centerPathLength += centerDistance
                 usageTime += timeDiff
 
-            lastCenter = center
+            center, lastCenter = lastCenter, center
             lastTimestamp = timestamp
 
         return centerPathLength, usageTime
 
+    def _fillTable(self, table, metrics):
+        """
+        Writes the metrics into the results table, one column per class.
+        """
+        rowLabels = (
+            "Center Path Length (mm)",
+            "Total Markup Path Length (mm)",
+            "Markup 1 Path Length (mm)",
+            "Markup 2 Path Length (mm)",
+            "Markup 3 Path Length (mm)",
+            "Markup 4 Path Length (mm)",
+            "Usage Time (s)"
+        )
+        columnLabels = tuple(metricData.className for metricData in metrics)
+
+        # Keep the existing table items if the same classes are shown again
+        tableSchema = (rowLabels, columnLabels)
+        if (tableSchema != self._lastTableSchema
+                or table.rowCount() != len(rowLabels)
+                or table.columnCount() != len(columnLabels)):
+            # Clear table
+            table.clear()
+
+            # Insert rows
+            table.setRowCount(len(rowLabels))
+            table.setVerticalHeaderLabels(list(rowLabels))
+
+            # Set column headers
+            table.setColumnCount(len(columnLabels))
+            table.setHorizontalHeaderLabels(list(columnLabels))
+        self._lastTableSchema = tableSchema
+
+        # Fill column data, metric fields after the class name are in row order.
+        # Existing items are reused, new items are only created for empty cells.
+        getItem = table.item
+        setItem = table.setItem
+        QTableWidgetItem = qt.QTableWidgetItem
+        for column, metricData in enumerate(metrics):
+            for row, value in enumerate(metricData[1:]):
+                text = value if isinstance(value, str) else f"{value:.2f}"
+                item = getItem(row, column)
+                if item is None:
+                    setItem(row, column, QTableWidgetItem(text))
+                else:
+                    item.setText(text)
+
     def calculate(self, sequenceBrowser, table):
 
         self.sequenceBrowser = sequenceBrowser
-        self.boundingBoxSequences = []
-        self.roiSequences = []
+        self.boundingBoxClassNames = []
+        self.boundingBoxSequenceNodes = []
+        self.roiClassNames = []
+        self.roiSequenceNodes = []
 
         # Get bounding box sequences from sequence browser
         synchronizedSequenceNodes = vtk.vtkCollection()
         self.sequenceBrowser.GetSynchronizedSequenceNodes(synchronizedSequenceNodes)
+        getItemAsObject = synchronizedSequenceNodes.GetItemAsObject
         for i in range(synchronizedSequenceNodes.GetNumberOfItems()):
-            sequenceNode = synchronizedSequenceNodes.GetItemAsObject(i)
-            if "Markups Sequence" in sequenceNode.GetName():
-                self.boundingBoxSequences.append(
-                    [sequenceNode.GetName().split(" ")[0].upper(), sequenceNode]
-                )
-            if "ROI_SEQUENCE" in sequenceNode.GetName():
-                self.roiSequences.append(
-                    [sequenceNode.GetName().split("_")[0].upper(), sequenceNode]
-                )
-
-        # Calculate metrics for each class
+            sequenceNode = getItemAsObject(i)
+            name = sequenceNode.GetName()
+            if "Markups Sequence" in name:
+                self.boundingBoxClassNames.append(name.partition(" ")[0].upper())
+                self.boundingBoxSequenceNodes.append(sequenceNode)
+            elif "ROI_SEQUENCE" in name:
+                self.roiClassNames.append(name.partition("_")[0].upper())
+                self.roiSequenceNodes.append(sequenceNode)
+
+        # Calculate metrics for each class, skipping empty sequences
         metrics = []
-        for i in range(len(self.boundingBoxSequences)):
-            currentMetrics = {}
-            centerPathLength, totalCornerPathLength, corner1PathLength, corner2PathLength, corner3PathLength, corner4PathLength, usageTime = (
-                self.calculateMetricsFromSequence(self.boundingBoxSequences[i][1])
-            )
-            currentMetrics["CENTER_PATH_LENGTH"] = centerPathLength
-            currentMetrics["TOTAL_CORNER_PATH_LENGTH"] = totalCornerPathLength
-            currentMetrics["CORNER_1_PATH_LENGTH"] = corner1PathLength
-            currentMetrics["CORNER_2_PATH_LENGTH"] = corner2PathLength
-            currentMetrics["CORNER_3_PATH_LENGTH"] = corner3PathLength
-            currentMetrics["CORNER_4_PATH_LENGTH"] = corner4PathLength
-            currentMetrics["USAGE_TIME"] = usageTime
-            currentMetrics["CLASS_NAME"] = self.boundingBoxSequences[i][0]
-            metrics.append(currentMetrics)
-
-        for i in range(len(self.roiSequences)):
-            currentMetrics = {}
+        boundingBoxClassNames = []
+        boundingBoxFrames = []
+        for className, sequenceNode in zip(self.boundingBoxClassNames, self.boundingBoxSequenceNodes):
+            if sequenceNode.GetNumberOfDataNodes() == 0:
+                continue
+            boundingBoxClassNames.append(className)
+            boundingBoxFrames.append(self.readFramesFromSequence(sequenceNode))
+
+        # Classes are independent, so with several classes and the compiled (nogil) kernel the path
+        # lengths are computed in parallel. Only the kernel runs in parallel: reading the frames above
+        # stays serial, as MRML nodes must only be accessed from the main thread.
+        if len(boundingBoxFrames) > 1 and _pathLengths is not _vectorizedPathLengths:
+            with ThreadPoolExecutor() as executor:
+                boundingBoxMetrics = list(executor.map(self.calculateMetricsFromFrames, boundingBoxFrames))
+        else:
+            boundingBoxMetrics = [self.calculateMetricsFromFrames(sequenceFrames) for sequenceFrames in boundingBoxFrames]
+        for className, classMetrics in zip(boundingBoxClassNames, boundingBoxMetrics):
+            metrics.append(SkillMetrics(className, *classMetrics))
+
+        for className, sequenceNode in zip(self.roiClassNames, self.roiSequenceNodes):
+            if sequenceNode.GetNumberOfDataNodes() == 0:
+                continue
             centerPathLength, usageTime = (
-                self.calculateMetricsFromROISequence(self.roiSequences[i][1])
+                self.calculateMetricsFromROISequence(sequenceNode)
             )
-            currentMetrics["CENTER_PATH_LENGTH"] = centerPathLength
-            currentMetrics["TOTAL_CORNER_PATH_LENGTH"] = "N/A"
-            currentMetrics["CORNER_1_PATH_LENGTH"] = "N/A"
-            currentMetrics["CORNER_2_PATH_LENGTH"] = "N/A"
-            currentMetrics["CORNER_3_PATH_LENGTH"] = "N/A"
-            currentMetrics["CORNER_4_PATH_LENGTH"] = "N/A"
-            currentMetrics["USAGE_TIME"] = usageTime
-            currentMetrics["CLASS_NAME"] = f"{self.roiSequences[i][0]}_ROI"
-            metrics.append(currentMetrics)
-
-        # Clear table
-        table.clear()
-
-        # Insert rows
-        rowLabels = [
-            "Center Path Length (mm)",
-            "Total Markup Path Length (mm)",
-            "Markup 1 Path Length (mm)",
-            "Markup 2 Path Length (mm)",
-            "Markup 3 Path Length (mm)",
-            "Markup 4 Path Length (mm)",
-            "Usage Time (s)"
-        ]
-        table.setRowCount(len(rowLabels))
-        table.setVerticalHeaderLabels(rowLabels)
-
-        # Set column headers
-        table.setColumnCount(len(metrics))
-        table.setHorizontalHeaderLabels([metricData["CLASS_NAME"] for metricData in metrics])
-
-        # Fill column data
-        for i in range(len(metrics)):
-            if "_ROI" in metrics[i]["CLASS_NAME"]:
-                table.setItem(0, i, qt.QTableWidgetItem(str(round(metrics[i]["CENTER_PATH_LENGTH"], 2))))
-                table.setItem(1, i, qt.QTableWidgetItem(str(metrics[i]["TOTAL_CORNER_PATH_LENGTH"])))
-                table.setItem(2, i, qt.QTableWidgetItem(str(metrics[i]["CORNER_1_PATH_LENGTH"])))
-                table.setItem(3, i, qt.QTableWidgetItem(str(metrics[i]["CORNER_2_PATH_LENGTH"])))
-                table.setItem(4, i, qt.QTableWidgetItem(str(metrics[i]["CORNER_3_PATH_LENGTH"])))
-                table.setItem(5, i, qt.QTableWidgetItem(str(metrics[i]["CORNER_4_PATH_LENGTH"])))
-                table.setItem(6, i, qt.QTableWidgetItem(str(round(metrics[i]["USAGE_TIME"], 2))))
-            else:
-                table.setItem(0, i, qt.QTableWidgetItem(str(round(metrics[i]["CENTER_PATH_LENGTH"], 2))))
-                table.setItem(1, i, qt.QTableWidgetItem(str(round(metrics[i]["TOTAL_CORNER_PATH_LENGTH"], 2))))
-                table.setItem(2, i, qt.QTableWidgetItem(str(round(metrics[i]["CORNER_1_PATH_LENGTH"], 2))))
-                table.setItem(3, i, qt.QTableWidgetItem(str(round(metrics[i]["CORNER_2_PATH_LENGTH"], 2))))
-                table.setItem(4, i, qt.QTableWidgetItem(str(round(metrics[i]["CORNER_3_PATH_LENGTH"], 2))))
-                table.setItem(5, i, qt.QTableWidgetItem(str(round(metrics[i]["CORNER_4_PATH_LENGTH"], 2))))
-                table.setItem(6, i, qt.QTableWidgetItem(str(round(metrics[i]["USAGE_TIME"], 2))))
+            metrics.append(SkillMetrics(
+                f"{className}_ROI",
+                centerPathLength,
+                "N/A", "N/A", "N/A", "N/A", "N/A",
+                usageTime
+            ))
+
+        # Disable repaints, signals and sorting while the table is filled
+        sortingEnabled = table.isSortingEnabled()
+        table.setSortingEnabled(False)
+        table.setUpdatesEnabled(False)
+        table.blockSignals(True)
+
+        try:
+            self._fillTable(table, metrics)
+        finally:
+            table.blockSignals(False)
+            table.setUpdatesEnabled(True)
+            table.setSortingEnabled(sortingEnabled)
 
         # Set table visible
         table.setVisible(True)
@@ -459,3 +590,79 @@ class CalculateSkillMetricsTest(ScriptedLoadableModuleTest):
     def runTest(self):
         """Run as few or as many tests as needed here."""
         self.setUp()
+        self.test_BoundingBoxMetrics()
+        self.setUp()
+        self.test_ROIMetrics()
+
+    def toPixels(self, xMM, yMM):
+        """
+        Returns the pixel position of a point given in mm, at depth z = focal length
+        (where one pixel from the principal point is one mm).
+        """
+        return [xMM + _PRINCIPAL_POINT[0], yMM + _PRINCIPAL_POINT[1], _FOCAL_LENGTH]
+
+    def test_BoundingBoxMetrics(self):
+        self.delayDisplay("Starting the bounding box metrics test")
+
+        # Corners in mm per timestamp, None is an all-zero (tool out of frame) frame
+        square = [[0, 0], [10, 0], [0, 10], [10, 10]]
+        framesMM = [
+            ("0", square),                                    # valid at timestamp 0
+            ("1", [[x + 3, y + 4] for x, y in square]),       # every corner moves 5 mm
+            ("2", None),                                      # invalid
+            ("3", [[x + 20, y] for x, y in square]),          # not counted, previous frame invalid
+            ("4", [[26, 8], [30, 0], [20, 10], [30, 10]]),    # only corner 1 moves, by 10 mm
+            ("5", square[:3]),                                # invalid, missing a corner
+        ]
+
+        markupsNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode")
+        sequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode")
+        for timestamp, corners in framesMM:
+            markupsNode.RemoveAllControlPoints()
+            if corners is None:
+                for i in range(_NUMBER_OF_CORNERS):
+                    markupsNode.AddControlPoint([0, 0, 0])
+            else:
+                for xMM, yMM in corners:
+                    markupsNode.AddControlPoint(self.toPixels(xMM, yMM))
+            sequenceNode.SetDataNodeAtValue(markupsNode, timestamp)
+
+        # Expected: center steps 5 and 2.5 (mean of the corner 1 step), usage time 1 + 1
+        logic = CalculateSkillMetricsLogic()
+        expected = [7.5, 30.0, 15.0, 5.0, 5.0, 5.0, 2.0]
+        for value, expectedValue in zip(logic.calculateMetricsFromSequence(sequenceNode), expected):
+            self.assertAlmostEqual(value, expectedValue, places=6)
+
+        # All path length kernels agree
+        frames, timestamps, validFrames = logic.readFramesFromSequence(sequenceNode)
+        self.assertEqual(validFrames.tolist(), [True, True, False, True, True, False])
+        for pathLengths in (_scanPathLengths, _vectorizedPathLengths, _pathLengths):
+            centerPathLength, cornerPathLengths, usageTime = pathLengths(frames, timestamps, validFrames)
+            self.assertAlmostEqual(float(centerPathLength), 7.5, places=6)
+            self.assertEqual(len(cornerPathLengths), _NUMBER_OF_CORNERS)
+            for cornerPathLength, expectedValue in zip(cornerPathLengths, [15.0, 5.0, 5.0, 5.0]):
+                self.assertAlmostEqual(float(cornerPathLength), expectedValue, places=6)
+            self.assertAlmostEqual(float(usageTime), 2.0, places=6)
+
+        # Empty sequences have no metrics
+        emptySequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode")
+        self.assertEqual(logic.calculateMetricsFromSequence(emptySequenceNode), (0.0,) * 7)
+
+        self.delayDisplay("Test passed")
+
+    def test_ROIMetrics(self):
+        self.delayDisplay("Starting the ROI metrics test")
+
+        roiNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsROINode")
+        sequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode")
+        for timestamp, center in [("0", [0, 0, 0]), ("1", [3, 4, 0]), ("2", [3, 4, 12])]:
+            roiNode.SetCenter(center)
+            sequenceNode.SetDataNodeAtValue(roiNode, timestamp)
+
+        # The step after the frame at timestamp 0 must be counted
+        logic = CalculateSkillMetricsLogic()
+        centerPathLength, usageTime = logic.calculateMetricsFromROISequence(sequenceNode)
+        self.assertAlmostEqual(centerPathLength, 17.0, places=6)
+        self.assertAlmostEqual(usageTime, 2.0, places=6)
+
+        self.delayDisplay("Test passed")